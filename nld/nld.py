@@ -1,6 +1,10 @@
 import logging
+import os
+import re
 import string
 import uuid
+from collections.abc import Iterator
+from itertools import islice
 from time import time
 import pandas as pd
 
@@ -46,12 +50,14 @@ class NLD(object):
         self.no_input = False
         self.df = None
 
-    def build_series(self, _func=None, *, vals=None):
+    def build_series(self, _func=None, *, vals=None, dtype=None):
         """
         Creates a series out of a list output from the previous function. If this is a list of lists or list of tuples,
         passing the value 'word' to the parameter `vals` will get only the tokens from the output.
         Passing `output` to `vals` will instead return only the second item in the results.
+        Passing "category" to `dtype` saves memory for outputs with a small vocabulary, "string" gives a typed string series.
         :param vals: a string that should be either "word" or "output"
+        :param dtype: a pandas dtype for the series
         """
         if vals and vals.lower() not in ["word", "output"]:
             raise ValueError("vals must be either `word` or `output` if provided")
@@ -65,9 +71,10 @@ class NLD(object):
             def build_series_wrapper(_input=None):
                 result = func(_input) if _input else func()
                 if vals:
-                    result = pd.Series([x[0 if vals == "word" else 1] for x in result])
+                    values = list(zip(*result))
+                    result = pd.Series(values[0 if vals == "word" else 1] if values else [], dtype=dtype)
                 else:
-                    result = pd.Series(result)
+                    result = pd.Series(result, dtype=dtype)
                 return result
             return build_series_wrapper
         if not _func:
@@ -75,10 +82,15 @@ class NLD(object):
         else:
             return build_series_decorator(_func)
 
-    def build_df(self, column, category=None):
+    def build_df(self, column, category=None, dtype=None):
         """
-        Returns a NLTK FreqDist from a given list.
-        :param number: Number of top most frequent items
+        Adds the output of the previous function to the `df` attribute, as a new row of `column` or, if the previous
+        decorator is build_series, as the whole column.
+        After build_series, `column` can also be a list of names to split a series of tuples into one column per item.
+        :param column: name of the column, or list of names of the columns
+        :param category: value of the "class" column for the new rows
+        :param dtype: a pandas dtype for the columns built from build_series, e.g. "category" or "string",
+        only accepted after build_series
         """
         @nldmethod
         def build_df_decorator(func):
@@ -95,6 +107,13 @@ class NLD(object):
                         self.df["class"] = None
                     if self.logger: self.logger.info("Build DF : Created column: %s", column)
                 result = func(_input) if _input else func()
+                if isinstance(result, Batch):
+                    rows = {column: list(result)}
+                    if category is not None:
+                        rows["class"] = category
+                    index = pd.RangeIndex(len(self.df), len(self.df) + len(result))
+                    self.df = pd.concat([self.df, pd.DataFrame(rows, index=index)])
+                    return result
                 new_row = self.df[column].count()
                 if not isinstance(column, pd.Series):
                     self.df.loc[new_row, column] = result
@@ -108,17 +127,29 @@ class NLD(object):
             def build_df_from_series_wrapper(_input=None):
                 if isinstance(self.df, type(None)):
                     self.df = pd.DataFrame()
-                if column not in self.df.columns:
-                    self.df[column] = None
-                    if category is not None and "class" not in self.df.columns:
-                        self.df["class"] = None
-                    if self.logger: self.logger.info("Build DF : Created column: %s", column)
+                columns = list(column) if isinstance(column, (list, tuple)) else [column]
+                for name in columns:
+                    if name not in self.df.columns:
+                        self.df[name] = None
+                        if category is not None and "class" not in self.df.columns:
+                            self.df["class"] = None
+                        if self.logger: self.logger.info("Build DF : Created column: %s", name)
                 result = func(_input) if _input else func()
-                self.df[column] = result
+                if isinstance(column, (list, tuple)):
+                    if not all(isinstance(item, (tuple, list)) and len(item) == len(columns) for item in result):
+                        raise ValueError("build_df can only split a series of tuples or lists of %d items into the columns %s"
+                                         % (len(columns), columns))
+                    values = list(zip(*result)) or [[]] * len(columns)
+                    for name, value in zip(columns, values):
+                        self.df[name] = pd.Series(value, index=result.index, dtype=dtype)
+                else:
+                    self.df[column] = result if dtype is None else result.astype(dtype)
                 return result
 
             if func.__name__ in ["build_series", "build_series_decorator", "build_series_wrapper"]:
                 return build_df_from_series_wrapper
+            if dtype is not None or isinstance(column, (list, tuple)):
+                raise ValueError("build_df only accepts `dtype` or a list of columns when the previous decorator is build_series")
             return build_df_wrapper
         return build_df_decorator
 
@@ -168,15 +199,18 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def freq_dist_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def freq_dist_stage(result):
                 if isinstance(result, list):
                     if self.logger:
                         self.logger.debug("Freq Dist : Getting frequencies...")
                     return FreqDist(result).most_common(number)
                 else:
                     raise TypeError("The input to freq_dist must be of type list")
+
+            @nldstage(func, freq_dist_stage)
+            def freq_dist_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(freq_dist_stage, result)
             return freq_dist_wrapper
 
         return freq_dist_decorator
@@ -189,12 +223,15 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def named_entity_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def named_entity_stage(result):
                 if isinstance(result, list) and isinstance(result[0], tuple):
                     return ne_chunk(result)
 
+            @nldstage(func, named_entity_stage)
+            def named_entity_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(named_entity_stage, result)
+
             return named_entity_wrapper
         if not _func:
             return named_entity_decorator
@@ -211,9 +248,7 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def pos_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def pos_stage(result):
                 if isinstance(result, str):
                     if self.logger:
                         self.logger.info("POS Tagger : Input to pos tagger is of type string.")
@@ -224,6 +259,11 @@ class NLD(object):
                     return list(pos_tag(result))
                 else:
                     raise TypeError("pos_tagger decorator only accepts string or list output, output received is %s" % type(result))
+
+            @nldstage(func, pos_stage)
+            def pos_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(pos_stage, result)
             return pos_wrapper
         if not _func:
             return pos_tagger_decorator
@@ -241,15 +281,18 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def ngrams_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def ngrams_stage(result):
                 if isinstance(result, str):
                     return list(ngrams(result.split(), number))
                 elif isinstance(result, list):
                     return list(ngrams(result, number))
                 else:
                     raise TypeError("n_grams decorator only accepts string or list output, output received is %s" % type(result))
+
+            @nldstage(func, ngrams_stage)
+            def ngrams_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(ngrams_stage, result)
             return ngrams_wrapper
 
         return ngrams_decorator
@@ -264,18 +307,22 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def stem_wrapper(_input=None):
-                stemmer = EnglishStemmer()
-                result = func(_input) if _input else func()
+            stemmer = EnglishStemmer()
+
+            def stem_stage(result):
                 if isinstance(result, list):
-                    if isinstance(result[0], tuple):
+                    if len(result) > 0 and isinstance(result[0], tuple):
                         for i in range(len(result)):
                             result[i] = list(result[i])
                             result[i][0] = stemmer.stem(result[i][0])
                             result[i] = tuple(result[i])
                         return result
                     return [stemmer.stem(word) for word in result]
+
+            @nldstage(func, stem_stage)
+            def stem_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(stem_stage, result)
             return stem_wrapper
         if not _func:
             return stem_decorator
@@ -292,10 +339,9 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def lemmatize_wrapper(_input=None):
-                lemmatizer = WordNetLemmatizer()
-                result = func(_input) if _input else func()
+            lemmatizer = WordNetLemmatizer()
+
+            def lemmatize_stage(result):
                 if isinstance(result, list):
                     if len(result) > 0 and isinstance(result[0], tuple):
                         if self.logger:
@@ -306,6 +352,11 @@ class NLD(object):
                             result[i] = tuple(result[i])
                         return result
                     return [lemmatizer.lemmatize(word) for word in result]
+
+            @nldstage(func, lemmatize_stage)
+            def lemmatize_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(lemmatize_stage, result)
             return lemmatize_wrapper
         if not _func:
             return lemmatize_decorator
@@ -329,9 +380,7 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def rm_stopwords_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def rm_stopwords_stage(result):
                 if not isinstance(result, list):
                     raise TypeError("remove_stopwords decorator only accepts a list output, output received is %s" % type(result))
                 if not punct:
@@ -340,6 +389,15 @@ class NLD(object):
                     punctuation = set(string.punctuation)
                     return [word for word in result if word not in self.stopwords and word not in punctuation]
 
+            def rm_stopwords_vectorized(tokens):
+                removed = set(self.stopwords) | set(string.punctuation if punct else extra)
+                return tokens[~tokens.isin(removed)]
+
+            @nldstage(func, rm_stopwords_stage, rm_stopwords_vectorized, filters=True)
+            def rm_stopwords_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(rm_stopwords_stage, result)
+
             return rm_stopwords_wrapper
         if not _func:
             return remove_stopwords_decorator
@@ -357,15 +415,18 @@ class NLD(object):
 
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def upper_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def upper_stage(result):
                 if isinstance(result, str):
                     return result.upper()
                 elif isinstance(result, list):
                     return [word.upper() for word in result]
                 else:
                     raise TypeError("upper decorator only accepts string or list output, output received is %s" % type(result))
+
+            @nldstage(func, upper_stage, lambda series: series.str.upper())
+            def upper_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(upper_stage, result)
             return upper_wrapper
         if not _func:
             return upper_decorator
@@ -384,15 +445,18 @@ class NLD(object):
 
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def lower_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def lower_stage(result):
                 if isinstance(result, str):
                     return result.lower()
                 elif isinstance(result, list):
                     return [word.lower() for word in result]
                 else:
                     raise TypeError("lower decorator only accepts string or list output, output received is %s" % type(result))
+
+            @nldstage(func, lower_stage, lambda series: series.str.lower())
+            def lower_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(lower_stage, result)
             return lower_wrapper
         if not _func:
             return lower_decorator
@@ -409,37 +473,91 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def sub_wrapper(*args, **kwargs):
-                import re
-                result = func(*args, **kwargs)
-                if self.logger:
-                    self.logger.info("Substitue : patterns: %s", patterns)
+            def sub_stage(result):
                 if isinstance(result, str):
                     for pattern in patterns:
                         old_word, new_word = pattern
                         result = re.sub(old_word, new_word, result)
-                        return result
+                    return result
                 elif isinstance(result, list):
                     for pattern in patterns:
                         old_word, new_word = pattern
                         result = [re.sub(old_word, new_word, word) for word in result]
-                        return result
+                    return result
                 else:
                     raise TypeError("substitute decorator only accepts string or list output, output received is %s" % type(result))
+
+            def sub_vectorized(series):
+                for old_word, new_word in patterns:
+                    series = series.str.replace(old_word, new_word, regex=True)
+                return series
+
+            @nldstage(func, sub_stage, sub_vectorized)
+            def sub_wrapper(*args, **kwargs):
+                result = func(*args, **kwargs)
+                if self.logger:
+                    self.logger.info("Substitue : patterns: %s", patterns)
+                return run_stage(sub_stage, result)
             return sub_wrapper
 
         return sub_decorator
 
-    def apply_to_column(self, column_name):
-        # TODO
+    def apply_to_column(self, column_name, new_column=None):
+        """
+        Runs the decorators below it over a whole column of a DataFrame and writes the results to a new column.
+        The DataFrame is the input of the decorated function, or the `df` attribute if no input is given.
+        The lower, upper and substitute steps run as vectorized pandas operations on a column of strings, and the
+        remove_stopwords step on a column of token lists. The other steps and the decorated function run item by item
+        in a single pass over the column.
+        :param column_name: name of the column to preprocess
+        :param new_column: name of the column for the results, defaults to `column_name` followed by "_nld"
+        :return:
+        """
+        if new_column is None:
+            new_column = column_name + "_nld"
+
+        @nldmethod
         def apply_to_column_decorator(func):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
+            stages = []
+            inner = func
+            while hasattr(inner, "stage"):
+                stages.insert(0, inner)
+                inner = inner.inner
+            if hasattr(inner, "nldmethod"):
+                raise TypeError("apply_to_column decorator can only be applied over decorators that process single items, "
+                                "%s cannot be used below it" % inner.__name__)
+
             @nldmethod
-            def apply_to_column_wrapper(*args, **kwargs):
-                raise NotImplementedError("This method is not developed / implemented yet.")
+            def apply_to_column_wrapper(_input=None):
+                df = self.df if _input is None else _input
+                if not isinstance(df, pd.DataFrame):
+                    raise TypeError("apply_to_column decorator only accepts a DataFrame input, input received is %s" % type(df))
+                if column_name not in df.columns:
+                    raise KeyError("Column %s not found in the DataFrame" % column_name)
+                result = df[column_name].reset_index(drop=True)
+                pending = [inner]
+                for stage in stages:
+                    if stage.vectorized is not None:
+                        if pending:
+                            result = apply_items(result, pending)
+                            pending = []
+                        vectorized = apply_vectorized(result, stage)
+                        if vectorized is not None:
+                            if self.logger:
+                                self.logger.info("Apply to column : %s vectorized", stage.__name__)
+                            result = vectorized
+                            continue
+                    pending.append(stage.stage)
+                if pending:
+                    result = apply_items(result, pending)
+                result.index = df.index
+                df[new_column] = result
+                return df
+            return apply_to_column_wrapper
+        return apply_to_column_decorator
 
     def word_tokenizer(self, _func=None):
         """
@@ -451,9 +569,7 @@ class NLD(object):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
-            @nldmethod
-            def word_tokenizer_wrapper(_input=None):
-                result = func(_input) if _input else func()
+            def word_tokenizer_stage(result):
                 if not isinstance(result, str):
                     raise TypeError("Decorator word_tokenizer only accepts string output, output received is %s" % type(result))
                 try:
@@ -462,6 +578,11 @@ class NLD(object):
                 except LookupError:
                     raise LookupError("You miss the stopwords module from NLTK, which is required for NLD. Execute nltk.download('punkt') to download it.")
                 return word_tokenize(result)
+
+            @nldstage(func, word_tokenizer_stage)
+            def word_tokenizer_wrapper(_input=None):
+                result = func(_input) if _input else func()
+                return run_stage(word_tokenizer_stage, result)
             return word_tokenizer_wrapper
 
         if not _func:
@@ -496,11 +617,15 @@ class NLD(object):
         else:
             return timeit_decorator(_func)
 
-    def iterator(self, track_number=None):
+    def iterator(self, track_number=None, batch_size=None):
         """
         Sets the iterable attribute if it was not set an returns the next item from it.
         This can be used to pass a list of sentences / texts to the next decorator for example.
+        The output of the decorated function can also be an iterator, such as the generator returned by `open_from_path`.
+        If `batch_size` is given, it returns a Batch with the next `batch_size` items instead, the following decorators
+        then process each item of the Batch and return a Batch of results.
         :param track_number: any string or number to keep track of iteration for different runs where the input function has the same name.
+        :param batch_size: number of items to return at once.
         :return:
         """
         def iterator_decorator(func):
@@ -510,44 +635,61 @@ class NLD(object):
             @nldmethod
             def iterator_wrapper(_input=None):
                 result = func(_input) if _input else func()
-                if not isinstance(result, list):
-                    raise TypeError("Decorator iterator_wrapper only accepts list output, output received is %s" % type(result))
+                if not isinstance(result, (list, Iterator)):
+                    raise TypeError("Decorator iterator_wrapper only accepts list or iterator output, output received is %s" % type(result))
                 key_name = func.__name__ + str(track_number) if track_number else func.__name__
                 if not self.iterable or key_name not in self.iterable:
-                    self.iterable[key_name] = (item for item in result)
+                    self.iterable[key_name] = iter(result)
                 try:
                     if self.logger:
                         self.logger.info("Iterable : key_name : %s", self.iterable[key_name])
+                    if batch_size:
+                        batch = Batch(islice(self.iterable[key_name], batch_size))
+                        if not batch:
+                            raise StopIteration
+                        return batch
                     return next(self.iterable[key_name])
                 except StopIteration:
                     raise StopIteration("There are no more iterables")
             return iterator_wrapper
         return iterator_decorator
 
-    def open_from_path(self, _func=None):
-        """
-        Opens a single file or all the files in a given directory.
-        :param func:
+    def open_from_path(self, _func=None, *, field="text", encoding=None, errors="strict", stream=False, buffer_size=1 << 20):
+        """
+        Opens a single file or all the files in a given directory. Gzip, bz2 and xz files are decompressed while reading,
+        JSONL and CSV files are read as one document per record, taking the text from the given field.
+        A plain text file returns its text, otherwise the documents are returned in a list, or one by one from a generator
+        if `stream` is True, so that they can be passed on by the `iterator` decorator without reading all of them at once.
+        :param field: name of the field holding the text in JSONL and CSV records
+        :param encoding: encoding of the files, defaults to the platform encoding as in `open`
+        :param errors: how decoding errors are handled, as in `open`, e.g. "strict", "ignore" or "replace"
+        :param stream: whether to return a generator of documents
+        :param buffer_size: size in bytes of the blocks read from the files
         :return:
         """
         def open_from_path_decorator(func):
             self._check_id(func)
             self.chain[self.id] += func.__name__ + "-"
 
+            def documents(paths):
+                for path in paths:
+                    yield from read_documents(path, field, encoding, errors, buffer_size)
+
             @nldmethod
             def open_from_path_wrapper(_input=None):
                 result = func(_input) if _input else func()
-                try:
-                    import os
-                    if isinstance(result, str) and os.path.isfile(result):
-                        with open(result) as output:
-                            output = output.read()
-                            return output
-                    elif isinstance(result, str) and os.path.isdir(result):
-                        output = [open(os.path.join(result, _file)).read() for _file in os.listdir(result)]
-                        return output
-                except:
-                    raise
+                if not isinstance(result, str):
+                    return None
+                path = os.path.expanduser(result)
+                if os.path.isfile(path):
+                    output = documents([path])
+                    if not stream and not get_record_format(path):
+                        return "".join(output)
+                elif os.path.isdir(path):
+                    output = documents(os.path.join(path, _file) for _file in sorted(os.listdir(path)))
+                else:
+                    return None
+                return output if stream else list(output)
             return open_from_path_wrapper
         if not _func:
             return open_from_path_decorator
@@ -563,7 +705,7 @@ class NLD(object):
         self._check_id(func)
         self.chain[self.id] += func.__name__ + "-"
 
-        @nldmethod
+        @nldstage(func, lambda result: result)
         def blank_wrapper(_input=None):
             result = func(_input) if _input else func()
             return result
@@ -1,3 +1,178 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+COMPRESSIONS = {b"\x1f\x8b": gzip.GzipFile, b"BZh": bz2.BZ2File, b"\xfd7zXZ\x00": lzma.LZMAFile}
+RECORD_FORMATS = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+CSV_FIELD_SIZE_LIMIT = 2 ** 31 - 1
+
+
 def nldmethod(func):
     func.nldmethod = True
     return func
+
+
+class Batch(list):
+    """
+    A list of items that NLD stages process one by one, as returned by the `iterator` decorator when a `batch_size` is set.
+    """
+
+
+def run_stage(stage, result):
+    """
+    Applies a NLD stage to a result, or to each item of the result if it is a Batch.
+    :param stage: a function that applies a decorator step to a single result
+    :param result: the output of the previous function
+    :return:
+    """
+    if isinstance(result, Batch):
+        return Batch([stage(item) for item in result])
+    return stage(result)
+
+
+def nldstage(inner, stage, vectorized=None, filters=False):
+    """
+    Marks a wrapper as a NLD stage, so that its step can be replayed on other inputs, e.g. by `apply_to_column`.
+    :param inner: the function wrapped by the decorator
+    :param stage: a function that applies the decorator step to a single result
+    :param vectorized: optional function that applies the decorator step to a pandas Series of strings
+    :param filters: whether `vectorized` drops items, so that it only makes sense on lists of tokens
+    :return:
+    """
+    def nldstage_decorator(wrapper):
+        wrapper.nldmethod = True
+        wrapper.inner = inner
+        wrapper.stage = stage
+        wrapper.vectorized = vectorized
+        wrapper.filters = filters
+        return wrapper
+    return nldstage_decorator
+
+
+def apply_vectorized(series, wrapper):
+    """
+    Applies the vectorized step of a NLD stage to a Series of strings or of lists of strings.
+    Steps that map each string are only vectorized on a Series of strings, since on lists of tokens pandas maps object
+    strings one by one anyway. Steps that filter tokens flatten the lists into a single Series of tokens and split the
+    tokens that are left back into lists from their offsets.
+    Missing values in a Series of strings are passed through as they are.
+    Returns None if the step cannot be vectorized for the values in the Series.
+    :param series: a pandas Series with a RangeIndex
+    :param wrapper: a function marked with `nldstage`
+    :return:
+    """
+    if wrapper.vectorized is None:
+        return None
+    if pd.api.types.infer_dtype(series, skipna=True) == "string":
+        return None if wrapper.filters else wrapper.vectorized(series)
+    if not wrapper.filters or not all(type(item) is list for item in series):
+        return None
+    tokens = pd.Series(list(chain.from_iterable(series)), dtype=object)
+    if len(tokens) and pd.api.types.infer_dtype(tokens, skipna=False) != "string":
+        return None
+    lengths = np.fromiter((len(item) for item in series), dtype=np.int64, count=len(series))
+    tokens = wrapper.vectorized(tokens)
+    rows = np.repeat(np.arange(len(series)), lengths)[tokens.index.to_numpy()]
+    ends = np.cumsum(np.bincount(rows, minlength=len(series))).tolist()
+    tokens = tokens.tolist()
+    return pd.Series([tokens[start:end] for start, end in zip([0] + ends[:-1], ends)], index=series.index, dtype=object)
+
+
+def apply_items(series, functions):
+    """
+    Applies the given functions, in order, to every item of a Series.
+    :param series: a pandas Series
+    :param functions: a list of functions taking a single item
+    :return:
+    """
+    results = []
+    for item in series.tolist():
+        for function in functions:
+            item = function(item)
+        results.append(item)
+    return pd.Series(results, index=series.index, dtype=object)
+
+
+def open_text(path, encoding=None, errors="strict", buffer_size=1 << 20, newline=None):
+    """
+    Opens a plain, gzip, bz2 or xz file in text mode, detecting the compression from the first bytes of the file.
+    The file is read and decoded in blocks of `buffer_size` bytes.
+    :param path: path of the file
+    :param encoding: encoding of the text, defaults to the platform encoding as in `open`
+    :param errors: how decoding errors are handled, as in `open`
+    :param buffer_size: size in bytes of the blocks read from the file
+    :param newline: how newlines are handled, as in `open`
+    :return:
+    """
+    with open(path, "rb") as raw:
+        magic = raw.read(6)
+    for signature, compression in COMPRESSIONS.items():
+        if magic.startswith(signature):
+            raw = io.BufferedReader(compression(path), buffer_size)
+            break
+    else:
+        raw = open(path, "rb", buffering=buffer_size)
+    text = io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline=newline)
+    # TextIOWrapper decodes 8 KB at a time unless its chunk size is raised
+    text._CHUNK_SIZE = buffer_size
+    return text
+
+
+def get_record_format(path):
+    """
+    Returns "jsonl" or "csv" if the file name has the extension of one of these formats, before any compression extension.
+    :param path: path of the file
+    :return:
+    """
+    name, extension = os.path.splitext(path.lower())
+    if extension in (".gz", ".bz2", ".xz"):
+        extension = os.path.splitext(name)[1]
+    return RECORD_FORMATS.get(extension)
+
+
+def read_documents(path, field="text", encoding=None, errors="strict", buffer_size=1 << 20):
+    """
+    Yields the documents in a file one by one. JSONL and CSV files, compressed or not, yield the `field` of each record,
+    other files yield their whole text as a single document.
+    :param path: path of the file
+    :param field: name of the field holding the text in JSONL and CSV records
+    :param encoding: encoding of the text, defaults to the platform encoding as in `open`
+    :param errors: how decoding errors are handled, as in `open`
+    :param buffer_size: size in bytes of the blocks read from the file
+    :return:
+    """
+    record_format = get_record_format(path)
+    with open_text(path, encoding, errors, buffer_size, newline="" if record_format == "csv" else None) as text:
+        if record_format == "jsonl":
+            for line_number, line in enumerate(text, 1):
+                if line.strip():
+                    record = json.loads(line)
+                    if field not in record:
+                        raise KeyError("Field %s not found in %s, line %d" % (field, path, line_number))
+                    yield record[field]
+        elif record_format == "csv":
+            reader = csv.DictReader(text)
+            while True:
+                # the default limit of 128 KB per field is smaller than many documents, the limit is process-wide
+                # so it is only raised while a row is read
+                limit = csv.field_size_limit()
+                csv.field_size_limit(max(limit, CSV_FIELD_SIZE_LIMIT))
+                try:
+                    row = next(reader, None)
+                finally:
+                    csv.field_size_limit(limit)
+                if row is None:
+                    break
+                if row.get(field) is None:
+                    raise KeyError("Field %s not found in %s, line %d" % (field, path, reader.line_num))
+                yield row[field]
+        else:
+            yield text.read()
@@ -1,6 +1,12 @@
+import bz2
+import csv
+import gzip
+import json
+import os
+import tempfile
 import unittest
 from unittest import TestCase
-from nld.nld import NLD
+from nld.nld import NLD, Batch
 import pandas as pd
 import numpy as np
 
@@ -137,4 +143,233 @@ class TestDecorators(TestCase):
         return_text_2(text)
 
         self.assertTrue(isinstance(self.nldecorator.df, pd.DataFrame))
-        self.assertTrue(len(self.nldecorator.df.columns) == 2)
\ No newline at end of file
+        self.assertTrue(len(self.nldecorator.df.columns) == 2)
+
+    def test_apply_to_column(self):
+
+        @self.nldecorator.apply_to_column("text", "tokens")
+        @self.nldecorator.stem
+        @self.nldecorator.remove_stopwords()
+        @self.nldecorator.substitute([("dolor", "pain")])
+        @self.nldecorator.lower
+        def return_tokens(text):
+            return text.split()
+
+        df = pd.DataFrame({"text": ["Lorem ipsum DOLOR sit amet", "the the", "Running dolor"]}, index=[3, 3, 7])
+        result = return_tokens(df)
+
+        self.assertTrue(result is df)
+        self.assertEqual(list(result.index), [3, 3, 7])
+        self.assertEqual(result["tokens"].tolist(), [["lorem", "ipsum", "pain", "sit", "amet"], [], ["run", "pain"]])
+
+    def test_apply_to_column_strings(self):
+
+        @self.nldecorator.apply_to_column("text")
+        @self.nldecorator.upper
+        def return_text(text):
+            return text
+
+        self.nldecorator.df = pd.DataFrame({"text": text.split(".")})
+        result = return_text()
+
+        self.assertTrue(result is self.nldecorator.df)
+        self.assertEqual(result["text_nld"].tolist(), [x.upper() for x in text.split(".")])
+
+    def test_apply_to_column_missing_values(self):
+
+        @self.nldecorator.apply_to_column("text")
+        @self.nldecorator.lower
+        def return_text(text):
+            return text
+
+        result = return_text(pd.DataFrame({"text": ["Lorem", None, "IPSUM"]}))
+
+        self.assertEqual(result["text_nld"][[0, 2]].tolist(), ["lorem", "ipsum"])
+        self.assertTrue(pd.isna(result["text_nld"][1]))
+
+    def test_apply_to_column_exception(self):
+
+        @self.nldecorator.apply_to_column("text")
+        @self.nldecorator.remove_stopwords()
+        def return_text(text):
+            return text
+
+        with self.assertRaises(TypeError):
+            return_text(pd.DataFrame({"text": ["Lorem ipsum"]}))
+
+    def test_apply_to_column_not_stage_exception(self):
+
+        @self.nldecorator.upper
+        def return_text(text):
+            return text
+
+        with self.assertRaises(TypeError):
+            self.nldecorator.apply_to_column("text")(self.nldecorator.lower(self.nldecorator.timeit(return_text)))
+
+    def test_apply_to_column_matches_loop(self):
+
+        @self.nldecorator.remove_stopwords()
+        @self.nldecorator.lower
+        def return_tokens(text):
+            return text.split()
+
+        apply_to_column = self.nldecorator.apply_to_column("text")(return_tokens)
+        sents = text.split(".") * 100
+        df = pd.DataFrame({"text": sents})
+        apply_to_column(df)
+
+        self.assertEqual(df["text_nld"].tolist(), [return_tokens(sent) for sent in sents])
+
+    def test_iterator_batch(self):
+
+        @self.nldecorator.lower
+        @self.nldecorator.iterator(batch_size=3)
+        def return_sents(text):
+            return text.split(".")
+
+        sents = text.split(".")
+        result = return_sents(text)
+        self.assertTrue(isinstance(result, Batch))
+        self.assertEqual(result, [x.lower() for x in sents[:3]])
+        self.assertEqual(return_sents(text), [x.lower() for x in sents[3:6]])
+
+    def test_build_df_batch(self):
+
+        @self.nldecorator.build_df(column="col.1", category="lorem")
+        @self.nldecorator.remove_stopwords()
+        @self.nldecorator.iterator(batch_size=4)
+        def return_tokens(text):
+            return [sent.split() for sent in text.split(".")]
+
+        return_tokens(text)
+        return_tokens(text)
+
+        self.assertEqual(len(self.nldecorator.df), 8)
+        self.assertTrue(all(isinstance(x, list) for x in self.nldecorator.df["col.1"]))
+        self.assertTrue((self.nldecorator.df["class"] == "lorem").all())
+
+    def test_build_df_batch_none(self):
+
+        @self.nldecorator.build_df(column="col.1")
+        @self.nldecorator.stem
+        @self.nldecorator.iterator(batch_size=2)
+        def return_tokens(tokens):
+            return tokens
+
+        tokens = [["running"], "lorem", ["dogs"], ["cats"]]
+        return_tokens(tokens)
+        return_tokens(tokens)
+
+        self.assertEqual(self.nldecorator.df["col.1"].tolist(), [["run"], None, ["dog"], ["cat"]])
+
+    def test_open_from_path_compressed(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            with gzip.open(os.path.join(directory, "docs.jsonl.gz"), "wt", encoding="utf-8") as output:
+                for sent in text.split("."):
+                    output.write(json.dumps({"id": 0, "text": sent}) + "\n")
+            with open(os.path.join(directory, "docs.txt"), "wb") as output:
+                output.write(b"Lorem \xff ipsum")
+
+            @self.nldecorator.open_from_path(encoding="utf-8", errors="replace")
+            def return_directory():
+                return directory
+
+            result = return_directory()
+            self.assertEqual(result, text.split(".") + ["Lorem � ipsum"])
+
+    def test_open_from_path_stream(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            with bz2.open(os.path.join(directory, "docs.csv.bz2"), "wt", encoding="utf-8", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["id", "body"])
+                writer.writerows(enumerate(text.split(".")))
+
+            @self.nldecorator.lower
+            @self.nldecorator.iterator()
+            @self.nldecorator.open_from_path(field="body", encoding="utf-8", stream=True)
+            def return_directory():
+                return directory
+
+            self.assertEqual(return_directory(), text.split(".")[0].lower())
+            self.assertEqual(return_directory(), text.split(".")[1].lower())
+
+    def test_open_from_path_large_csv_field(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "docs.csv")
+            with open(path, "w", encoding="utf-8", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["id", "text"])
+                writer.writerow([0, text * 1000])
+
+            @self.nldecorator.open_from_path(encoding="utf-8", stream=True)
+            def return_file():
+                return path
+
+            limit = csv.field_size_limit()
+            documents = return_file()
+            self.assertEqual(next(documents), text * 1000)
+            self.assertEqual(csv.field_size_limit(), limit)
+            self.assertEqual(list(documents), [])
+            self.assertEqual(csv.field_size_limit(), limit)
+
+    def test_open_from_path_missing_field(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "docs.jsonl")
+            with open(path, "w", encoding="utf-8") as output:
+                output.write(json.dumps({"text": text}) + "\n")
+                output.write(json.dumps({"body": text}) + "\n")
+
+            @self.nldecorator.open_from_path(encoding="utf-8")
+            def return_file():
+                return path
+
+            with self.assertRaisesRegex(KeyError, "docs.jsonl, line 2"):
+                return_file()
+
+    def test_build_series_dtype(self):
+
+        @self.nldecorator.build_series(vals="word", dtype="category")
+        def return_tags(text):
+            return [(word, "NN") for word in text.split()]
+
+        result = return_tags(text)
+        self.assertEqual(result.dtype, "category")
+        self.assertEqual(result.tolist(), text.split())
+
+    def test_build_df_split_series(self):
+
+        @self.nldecorator.build_df(column=["word", "tag"], dtype="category")
+        @self.nldecorator.build_series()
+        def return_tags(text):
+            return [(word, "NN") for word in text.split()]
+
+        return_tags(text)
+
+        self.assertEqual(list(self.nldecorator.df.columns), ["word", "tag"])
+        self.assertTrue((self.nldecorator.df.dtypes == "category").all())
+        self.assertEqual(self.nldecorator.df["word"].tolist(), text.split())
+        self.assertEqual(self.nldecorator.df["tag"].cat.categories.tolist(), ["NN"])
+
+    def test_build_df_split_series_exception(self):
+
+        @self.nldecorator.build_df(column=["word", "tag"])
+        @self.nldecorator.build_series(vals="word")
+        def return_tags(text):
+            return [(word, "NN") for word in text.split()]
+
+        with self.assertRaises(ValueError):
+            return_tags(text)
+
+    def test_build_df_dtype_exception(self):
+
+        def return_text(text):
+            return text
+
+        with self.assertRaises(ValueError):
+            self.nldecorator.build_df(column="col.1", dtype="category")(return_text)
+        with self.assertRaises(ValueError):
+            self.nldecorator.build_df(column=["word", "tag"])(return_text)